@@ -6,18 +6,211 @@ Returns: HTTP response со списком заявок или статусом
 
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import hashlib
+import time
+from typing import Dict, Any, Optional
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+REPLAYED_HEADERS = {**JSON_HEADERS, 'Idempotent-Replayed': 'true'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Role, Idempotency-Key',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
+
+ACCESS_DENIED_RESPONSE = {
+    'statusCode': 403,
+    'headers': JSON_HEADERS,
+    'body': json.dumps({'error': 'Access denied'})
+}
+
+APPLICATION_STATUSES = ('pending', 'approved', 'rejected')
+
+STATUS_UPDATE_QUERY = """
+    WITH target AS (
+        SELECT id, status, row_version
+        FROM applications
+        WHERE id = %s
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE applications ap
+        SET status = %s
+        FROM target t
+        WHERE ap.id = t.id AND (%s::bigint IS NULL OR ap.row_version = %s::bigint)
+        RETURNING ap.full_name, ap.email, t.status as old_status, ap.row_version
+    )
+    SELECT t.row_version as current_version, up.full_name, up.email, up.old_status, up.row_version
+    FROM target t
+    LEFT JOIN updated up ON TRUE
+"""
+
+IDEMPOTENCY_TTL_HOURS = 24
+IDEMPOTENCY_CACHE_SIZE = 256
+IDEMPOTENCY_CLEANUP_INTERVAL = 3600
+IDEMPOTENCY_CLEANUP_BATCH = 500
+
+_idempotency_cache: Dict[Any, Any] = {}
+_idempotency_cleanup = {'last': 0.0}
+
+def get_idempotency(event: Dict[str, Any], scope: str) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers', {}) or {}
+    key = headers.get('idempotency-key', headers.get('Idempotency-Key'))
+    
+    if not key:
+        return None
+    
+    # Автор и права берутся из заголовков, поэтому тот же ключ от другого пользователя — другой запрос
+    fingerprint = json.dumps([
+        event.get('path') or '',
+        event.get('queryStringParameters') or {},
+        event.get('body') or '',
+        headers.get('x-user-id', headers.get('X-User-Id')) or '',
+        headers.get('x-user-role', headers.get('X-User-Role')) or ''
+    ], sort_keys=True)
+    
+    return {
+        'scope': f"{scope}:{event.get('httpMethod', 'GET')}",
+        'key': key[:255],
+        'request_hash': hashlib.sha256(fingerprint.encode()).hexdigest()
+    }
+
+def load_idempotent_response(cursor, idempotency: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not idempotency:
+        return None
+    
+    cache_key = (idempotency['scope'], idempotency['key'])
+    stored = _idempotency_cache.get(cache_key)
+    
+    if not stored or stored['expires'] <= time.time():
+        # Без курсора проверяется только кэш контейнера: повтор не должен платить за подключение к БД
+        if cursor is None:
+            return None
+        cursor.execute(
+            """
+            SELECT request_hash, status_code, response_body, 
+                   EXTRACT(EPOCH FROM expires_at - NOW()) as ttl
+            FROM idempotency_keys
+            WHERE scope = %s AND key = %s AND expires_at > NOW()
+            """,
+            cache_key
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        stored = remember_idempotent_response(cache_key, row['request_hash'], row['status_code'], row['response_body'], float(row['ttl']))
+    
+    if stored['request_hash'] != idempotency['request_hash']:
+        return {
+            'statusCode': 422,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+        }
+    
+    return {
+        'statusCode': stored['status_code'],
+        'headers': REPLAYED_HEADERS,
+        'body': stored['response_body']
+    }
+
+def remember_idempotent_response(cache_key, request_hash: str, status_code: int, response_body: str, ttl: float) -> Dict[str, Any]:
+    if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+        now = time.time()
+        for expired in [k for k, v in _idempotency_cache.items() if v['expires'] <= now]:
+            del _idempotency_cache[expired]
+        if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+            _idempotency_cache.clear()
+    
+    stored = {
+        'request_hash': request_hash,
+        'status_code': status_code,
+        'response_body': response_body,
+        'expires': time.time() + ttl
+    }
+    _idempotency_cache[cache_key] = stored
+    return stored
+
+def commit_idempotent(conn, cursor, idempotency: Optional[Dict[str, Any]], response: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''Коммитит запись вместе с ключом идемпотентности (истёкший ключ перезаписывается); при гонке дублей откатывает запись и возвращает сохранённый ответ или 409.'''
+    if not idempotency:
+        conn.commit()
+        return None
+    
+    cursor.execute(
+        """
+        INSERT INTO idempotency_keys (scope, key, request_hash, status_code, response_body, expires_at)
+        VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 hour')
+        ON CONFLICT (scope, key) DO UPDATE SET
+            request_hash = EXCLUDED.request_hash,
+            status_code = EXCLUDED.status_code,
+            response_body = EXCLUDED.response_body,
+            created_at = CURRENT_TIMESTAMP,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= NOW()
+        RETURNING key
+        """,
+        (idempotency['scope'], idempotency['key'], idempotency['request_hash'],
+         response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS)
+    )
+    
+    if cursor.fetchone() is None:
+        conn.rollback()
+        return load_idempotent_response(cursor, idempotency) or {
+            'statusCode': 409,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Request with this Idempotency-Key is in progress, retry later'})
+        }
+    
+    conn.commit()
+    remember_idempotent_response(
+        (idempotency['scope'], idempotency['key']), idempotency['request_hash'],
+        response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS * 3600
+    )
+    
+    if time.time() - _idempotency_cleanup['last'] > IDEMPOTENCY_CLEANUP_INTERVAL:
+        _idempotency_cleanup['last'] = time.time()
+        cursor.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE (scope, key) IN (
+                SELECT scope, key FROM idempotency_keys
+                WHERE expires_at < NOW()
+                LIMIT %s
+            )
+            """,
+            (IDEMPOTENCY_CLEANUP_BATCH,)
+        )
+        conn.commit()
+    
+    return None
 
 def get_db_connection():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
 def send_email(to_email: str, subject: str, body: str):
     try:
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
         smtp_host = os.environ.get('SMTP_HOST')
         smtp_port = int(os.environ.get('SMTP_PORT', 587))
         smtp_user = os.environ.get('SMTP_USER')
@@ -44,21 +237,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Role',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return OPTIONS_RESPONSE
+    
+    idempotency = get_idempotency(event, 'applications') if method in ('POST', 'PUT') else None
+    replay = load_idempotent_response(None, idempotency)
+    if replay:
+        return replay
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor = get_cursor(conn)
     
     try:
+        replay = load_idempotent_response(cursor, idempotency)
+        if replay:
+            return replay
+        
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
             
@@ -67,24 +260,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 (body.get('full_name'), body.get('email'), body.get('phone'), body.get('message'))
             )
             result = cursor.fetchone()
-            conn.commit()
             
-            return {
+            response = {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'success': True, 'id': result['id']})
             }
+            replay = commit_idempotent(conn, cursor, idempotency, response)
+            
+            return replay or response
         
         elif method == 'GET':
             headers = event.get('headers', {})
             user_role = headers.get('x-user-role', headers.get('X-User-Role', ''))
             
             if user_role != 'admin':
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Access denied'})
-                }
+                return ACCESS_DENIED_RESPONSE
             
             cursor.execute(
                 "SELECT * FROM applications ORDER BY created_at DESC"
@@ -93,7 +284,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps([dict(app) for app in applications], default=str)
             }
         
@@ -101,20 +292,46 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body = json.loads(event.get('body', '{}'))
             app_id = body.get('id')
             status = body.get('status')
+            expected_version = body.get('row_version')
+            
+            if status not in APPLICATION_STATUSES:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'Invalid status'})
+                }
             
             cursor.execute(
-                "SELECT full_name, email FROM applications WHERE id = %s",
-                (app_id,)
+                STATUS_UPDATE_QUERY,
+                (app_id, status, expected_version, expected_version)
             )
             app = cursor.fetchone()
             
-            cursor.execute(
-                "UPDATE applications SET status = %s WHERE id = %s",
-                (status, app_id)
-            )
-            conn.commit()
+            if not app:
+                return {
+                    'statusCode': 404,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'Application not found'})
+                }
+            
+            if app['row_version'] is None:
+                conn.rollback()
+                return {
+                    'statusCode': 409,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'Application was modified by another request', 'row_version': app['current_version']})
+                }
+            
+            response = {
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'success': True, 'row_version': app['row_version']})
+            }
+            replay = commit_idempotent(conn, cursor, idempotency, response)
+            if replay:
+                return replay
             
-            if app and app['email']:
+            if app['email'] and app['old_status'] != status:
                 if status == 'approved':
                     subject = '✅ Ваша заявка одобрена!'
                     body_html = f'''
@@ -150,17 +367,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if subject:
                     send_email(app['email'], subject, body_html)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True})
-            }
+            return response
         
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return METHOD_NOT_ALLOWED_RESPONSE
     
     finally:
         cursor.close()
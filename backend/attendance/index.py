@@ -8,51 +8,105 @@ import json
 import os
 from typing import Dict, Any
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Role',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
+
+# Если день уже перенесён в архив, правится архивная запись и сводка по четверти,
+# иначе новая живая строка посчиталась бы в профиле второй раз (сводка + attendance)
+UPSERT_ATTENDANCE_QUERY = """
+    WITH previous AS (
+        SELECT id, present
+        FROM attendance_archive
+        WHERE user_id = %(user_id)s AND date = %(date)s
+        FOR UPDATE
+    ),
+    archived AS (
+        UPDATE attendance_archive ar
+        SET present = %(present)s, notes = %(notes)s
+        FROM previous p
+        WHERE ar.id = p.id AND ar.user_id = %(user_id)s AND ar.date = %(date)s
+        RETURNING COALESCE(ar.present, FALSE)::integer - COALESCE(p.present, FALSE)::integer as present_delta
+    ),
+    summarized AS (
+        UPDATE attendance_term_summary
+        SET present_days = present_days + (SELECT SUM(present_delta) FROM archived),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = %(user_id)s
+          AND term_start = date_trunc('quarter', %(date)s::date)::date
+          AND EXISTS (SELECT 1 FROM archived)
+    ),
+    live AS (
+        INSERT INTO attendance (user_id, date, present, notes)
+        SELECT %(user_id)s, %(date)s, %(present)s, %(notes)s
+        WHERE NOT EXISTS (SELECT 1 FROM previous)
+        ON CONFLICT (user_id, date) 
+        DO UPDATE SET present = EXCLUDED.present, notes = EXCLUDED.notes
+    )
+    SELECT EXISTS (SELECT 1 FROM previous) as archived
+"""
 
 def get_db_connection():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Role',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return OPTIONS_RESPONSE
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor = get_cursor(conn)
     
     try:
         if method == 'GET':
             params = event.get('queryStringParameters', {}) or {}
             date = params.get('date', datetime.now().strftime('%Y-%m-%d'))
             
+            # Старые отметки перенесены обслуживанием в attendance_archive, читаем обе таблицы
             cursor.execute("""
                 SELECT 
                     u.id, u.full_name, u.email,
                     COALESCE(a.present, false) as present,
-                    a.notes
+                    a.notes,
+                    COALESCE(a.archived, false) as archived
                 FROM users u
-                LEFT JOIN attendance a ON u.id = a.user_id AND a.date = %s
+                LEFT JOIN (
+                    SELECT user_id, present, notes, FALSE as archived FROM attendance WHERE date = %s
+                    UNION ALL
+                    SELECT user_id, present, notes, TRUE as archived FROM attendance_archive WHERE date = %s
+                ) a ON u.id = a.user_id
                 WHERE u.role = 'member'
                 ORDER BY u.full_name
-            """, (date,))
+            """, (date, date))
             
             attendance = cursor.fetchall()
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({
                     'date': date,
                     'attendance': [dict(a) for a in attendance]
@@ -66,26 +120,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             present = body.get('present', False)
             notes = body.get('notes', '')
             
-            cursor.execute("""
-                INSERT INTO attendance (user_id, date, present, notes)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id, date) 
-                DO UPDATE SET present = EXCLUDED.present, notes = EXCLUDED.notes
-            """, (user_id, date, present, notes))
+            cursor.execute(UPSERT_ATTENDANCE_QUERY, {
+                'user_id': user_id,
+                'date': date,
+                'present': present,
+                'notes': notes
+            })
+            result = cursor.fetchone()
             
             conn.commit()
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True})
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'success': True, 'archived': result['archived']})
             }
         
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return METHOD_NOT_ALLOWED_RESPONSE
     
     finally:
         cursor.close()
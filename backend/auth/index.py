@@ -11,12 +11,35 @@ import secrets
 import hmac
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
 
 def get_db_connection():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -40,19 +63,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return OPTIONS_RESPONSE
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor = get_cursor(conn)
     
     try:
         if method == 'POST':
@@ -75,7 +89,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({
                         'success': True,
                         'token': token,
@@ -97,7 +111,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     token = generate_token()
                     return {
                         'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({
                             'success': True,
                             'token': token,
@@ -107,7 +121,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 else:
                     return {
                         'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'success': False, 'error': 'Неверные данные'})
                     }
             
@@ -116,14 +130,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if not bot_token:
                     return {
                         'statusCode': 500,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'error': 'Bot token not configured'})
                     }
                 
                 if not verify_telegram_auth(body, bot_token):
                     return {
                         'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'error': 'Invalid authentication data'})
                     }
                 
@@ -142,7 +156,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     if not user['is_active']:
                         return {
                             'statusCode': 403,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'headers': JSON_HEADERS,
                             'body': json.dumps({'error': 'Account is deactivated'})
                         }
                     
@@ -155,7 +169,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     token = generate_token()
                     return {
                         'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({
                             'success': True,
                             'token': token,
@@ -179,7 +193,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     token = generate_token()
                     return {
                         'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({
                             'success': True,
                             'token': token,
@@ -187,11 +201,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         })
                     }
         
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return METHOD_NOT_ALLOWED_RESPONSE
     
     finally:
         cursor.close()
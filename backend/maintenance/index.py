@@ -0,0 +1,299 @@
+'''
+Business: Плановое обслуживание БД: архивация посещаемости и истории ролей, сводки по четвертям, очистка служебных таблиц
+Args: event с httpMethod, headers (X-Maintenance-Token); context с request_id
+Returns: HTTP response с количеством перенесённых и удалённых строк
+'''
+
+import json
+import os
+import hmac
+import time
+from typing import Dict, Any, Callable
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
+
+ACCESS_DENIED_RESPONSE = {
+    'statusCode': 403,
+    'headers': JSON_HEADERS,
+    'body': json.dumps({'error': 'Access denied'})
+}
+
+ATTENDANCE_RETENTION_DAYS = int(os.environ.get('ATTENDANCE_RETENTION_DAYS', 365))
+ROLE_HISTORY_RETENTION_DAYS = int(os.environ.get('ROLE_HISTORY_RETENTION_DAYS', 730))
+INACTIVE_USER_RETENTION_DAYS = int(os.environ.get('INACTIVE_USER_RETENTION_DAYS', 180))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 90))
+
+BATCH_SIZE = 1000
+MAX_RUNTIME_SECONDS = 20
+BATCH_PAUSE_SECONDS = 0.05
+LOCK_TIMEOUT = '2s'
+STATEMENT_TIMEOUT = '10s'
+ADVISORY_LOCK_ID = 84683043
+
+ARCHIVE_ATTENDANCE_QUERY = """
+    WITH moved AS (
+        DELETE FROM attendance
+        WHERE id IN (
+            SELECT a.id
+            FROM attendance a
+            WHERE a.date < CURRENT_DATE - %(retention_days)s
+               OR a.user_id IN (
+                   SELECT id FROM users
+                   WHERE is_active = FALSE
+                     AND updated_at < NOW() - %(inactive_days)s * INTERVAL '1 day'
+               )
+            ORDER BY a.date
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, date, present, notes, created_at
+    ),
+    archived AS (
+        INSERT INTO attendance_archive (id, user_id, date, present, notes, created_at)
+        SELECT id, user_id, date, present, notes, created_at
+        FROM moved
+    ),
+    summarized AS (
+        INSERT INTO attendance_term_summary (user_id, term_start, recorded_days, present_days)
+        SELECT
+            user_id,
+            date_trunc('quarter', date)::date,
+            COUNT(*)::integer,
+            COUNT(*) FILTER (WHERE present)::integer
+        FROM moved
+        WHERE user_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, term_start) DO UPDATE SET
+            recorded_days = attendance_term_summary.recorded_days + EXCLUDED.recorded_days,
+            present_days = attendance_term_summary.present_days + EXCLUDED.present_days,
+            updated_at = CURRENT_TIMESTAMP
+    )
+    SELECT COUNT(*)::integer as affected FROM moved
+"""
+
+ARCHIVE_ROLE_HISTORY_QUERY = """
+    WITH moved AS (
+        DELETE FROM role_history
+        WHERE id IN (
+            SELECT id
+            FROM role_history
+            WHERE changed_at < NOW() - %(retention_days)s * INTERVAL '1 day'
+            ORDER BY changed_at
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason
+    ),
+    archived AS (
+        INSERT INTO role_history_archive (id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason)
+        SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason
+        FROM moved
+    )
+    SELECT COUNT(*)::integer as affected FROM moved
+"""
+
+PRUNE_IDEMPOTENCY_KEYS_QUERY = """
+    WITH pruned AS (
+        DELETE FROM idempotency_keys
+        WHERE (scope, key) IN (
+            SELECT scope, key FROM idempotency_keys
+            WHERE expires_at < NOW()
+            LIMIT %(batch_size)s
+        )
+        RETURNING 1
+    )
+    SELECT COUNT(*)::integer as affected FROM pruned
+"""
+
+PRUNE_TOMBSTONES_QUERY = """
+    WITH pruned AS (
+        DELETE FROM deleted_rows
+        WHERE id IN (
+            SELECT id FROM deleted_rows
+            WHERE deleted_at < NOW() - %(retention_days)s * INTERVAL '1 day'
+            ORDER BY id
+            LIMIT %(batch_size)s
+        )
+        RETURNING row_version
+    ),
+    watermark AS (
+        UPDATE change_feed_pruned
+        SET pruned_version = GREATEST(pruned_version, (SELECT MAX(row_version) FROM pruned)),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE EXISTS (SELECT 1 FROM pruned)
+    )
+    SELECT COUNT(*)::integer as affected FROM pruned
+"""
+
+PRUNE_CHANGE_WATERMARKS_QUERY = """
+    WITH pruned AS (
+        DELETE FROM change_feed_watermarks
+        WHERE id IN (
+            SELECT id FROM change_feed_watermarks
+            WHERE recorded_at < NOW() - INTERVAL '1 day'
+              AND id < (SELECT MAX(id) FROM change_feed_watermarks)
+            ORDER BY id
+            LIMIT %(batch_size)s
+        )
+        RETURNING 1
+    )
+    SELECT COUNT(*)::integer as affected FROM pruned
+"""
+
+def get_db_connection():
+    import psycopg2
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+def ensure_yearly_partitions(cursor, table: str, oldest_query: str, params: Dict[str, Any]):
+    cursor.execute(oldest_query, params)
+    oldest = cursor.fetchone()['oldest']
+    if oldest is None:
+        return
+    
+    for year in range(oldest.year, time.localtime().tm_year + 1):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+
+def run_batches(conn, cursor, query: str, params: Dict[str, Any], deadline: float, archiving: bool = False) -> Dict[str, Any]:
+    '''Выполняет запрос пачками по BATCH_SIZE с коммитом после каждой, пока пачка не пуста и не истёк бюджет времени.'''
+    total = 0
+    
+    while time.monotonic() < deadline:
+        cursor.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+        cursor.execute("SET LOCAL statement_timeout = %s", (STATEMENT_TIMEOUT,))
+        if archiving:
+            cursor.execute("SET LOCAL app.archiving = 'on'")
+        
+        cursor.execute(query, dict(params, batch_size=BATCH_SIZE))
+        affected = cursor.fetchone()['affected']
+        conn.commit()
+        total += affected
+        
+        # Короткая пачка ещё не значит конец: SKIP LOCKED пропускает строки, занятые другими транзакциями
+        if affected == 0:
+            return {'rows': total, 'done': True}
+        
+        time.sleep(BATCH_PAUSE_SECONDS)
+    
+    return {'rows': total, 'done': False}
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
+    if method != 'POST':
+        return METHOD_NOT_ALLOWED_RESPONSE
+    
+    expected_token = os.environ.get('MAINTENANCE_TOKEN')
+    if not expected_token:
+        return {
+            'statusCode': 500,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Maintenance token not configured'})
+        }
+    
+    headers = event.get('headers', {}) or {}
+    token = headers.get('x-maintenance-token', headers.get('X-Maintenance-Token', ''))
+    
+    if not hmac.compare_digest(token.encode(), expected_token.encode()):
+        return ACCESS_DENIED_RESPONSE
+    
+    deadline = time.monotonic() + MAX_RUNTIME_SECONDS
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    
+    try:
+        cursor.execute("SELECT pg_try_advisory_lock(%s) as locked", (ADVISORY_LOCK_ID,))
+        locked = cursor.fetchone()['locked']
+        conn.commit()
+        
+        if not locked:
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Maintenance is already running'})
+            }
+        
+        try:
+            attendance_params = {
+                'retention_days': ATTENDANCE_RETENTION_DAYS,
+                'inactive_days': INACTIVE_USER_RETENTION_DAYS
+            }
+            role_history_params = {'retention_days': ROLE_HISTORY_RETENTION_DAYS}
+            
+            ensure_yearly_partitions(
+                cursor,
+                'attendance_archive',
+                """
+                SELECT MIN(a.date) as oldest
+                FROM attendance a
+                WHERE a.date < CURRENT_DATE - %(retention_days)s
+                   OR a.user_id IN (
+                       SELECT id FROM users
+                       WHERE is_active = FALSE
+                         AND updated_at < NOW() - %(inactive_days)s * INTERVAL '1 day'
+                   )
+                """,
+                attendance_params
+            )
+            ensure_yearly_partitions(
+                cursor,
+                'role_history_archive',
+                "SELECT MIN(changed_at) as oldest FROM role_history WHERE changed_at < NOW() - %(retention_days)s * INTERVAL '1 day'",
+                role_history_params
+            )
+            conn.commit()
+            
+            steps: Dict[str, Callable[[], Dict[str, Any]]] = {
+                'attendance_archived': lambda: run_batches(conn, cursor, ARCHIVE_ATTENDANCE_QUERY, attendance_params, deadline, archiving=True),
+                'role_history_archived': lambda: run_batches(conn, cursor, ARCHIVE_ROLE_HISTORY_QUERY, role_history_params, deadline, archiving=True),
+                'idempotency_keys_pruned': lambda: run_batches(conn, cursor, PRUNE_IDEMPOTENCY_KEYS_QUERY, {}, deadline),
+                'tombstones_pruned': lambda: run_batches(conn, cursor, PRUNE_TOMBSTONES_QUERY, {'retention_days': TOMBSTONE_RETENTION_DAYS}, deadline),
+                'change_watermarks_pruned': lambda: run_batches(conn, cursor, PRUNE_CHANGE_WATERMARKS_QUERY, {}, deadline),
+            }
+            
+            report = {name: step() for name, step in steps.items()}
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+            conn.commit()
+        
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({
+                'success': True,
+                'done': all(step['done'] for step in report.values()),
+                'report': report
+            })
+        }
+    
+    finally:
+        cursor.close()
+        conn.close()
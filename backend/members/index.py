@@ -1,51 +1,735 @@
 '''
-Business: Управление участниками клуба (получение списка, удаление, изменение роли)
+Business: Управление участниками клуба (получение списка, сводка для панели администратора, профиль участника, аналитика оценок, журнал изменений для синхронизации, удаление, изменение роли)
 Args: event с httpMethod, body, headers; context с request_id
 Returns: HTTP response со списком участников или статусом операции
 '''
 
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import hashlib
+import time
+from typing import Dict, Any, Optional
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+REPLAYED_HEADERS = {**JSON_HEADERS, 'Idempotent-Replayed': 'true'}
+CACHE_HIT_HEADERS = {**JSON_HEADERS, 'X-Cache': 'HIT'}
+CACHE_MISS_HEADERS = {**JSON_HEADERS, 'X-Cache': 'MISS'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, PUT, DELETE, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Role, X-User-Id, Idempotency-Key',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
+
+ACCESS_DENIED_RESPONSE = {
+    'statusCode': 403,
+    'headers': JSON_HEADERS,
+    'body': json.dumps({'error': 'Access denied'})
+}
+
+DASHBOARD_CACHE_TTL = 30
+
+_dashboard_cache: Dict[str, Any] = {'body': None, 'expires': 0.0}
+
+DASHBOARD_QUERY = """
+    WITH member_stats AS (
+        SELECT COUNT(*)::integer as member_count
+        FROM users
+        WHERE is_active = TRUE AND role = 'member'
+    ),
+    application_stats AS (
+        SELECT COUNT(*)::integer as pending_applications
+        FROM applications
+        WHERE status = 'pending'
+    ),
+    attendance_today AS (
+        SELECT 
+            COUNT(u.id)::integer as expected_today,
+            COUNT(a.id) FILTER (WHERE a.present)::integer as present_today
+        FROM users u
+        LEFT JOIN attendance a ON u.id = a.user_id AND a.date = CURRENT_DATE
+        WHERE u.role = 'member' AND u.is_active = TRUE
+    ),
+    recent_news AS (
+        SELECT COALESCE(json_agg(n ORDER BY n.created_at DESC), '[]'::json) as items
+        FROM (
+            SELECT n.id, n.title, n.image_url, n.created_at, u.full_name as author_name
+            FROM news n
+            LEFT JOIN users u ON n.author_id = u.id
+            ORDER BY n.created_at DESC
+            LIMIT 5
+        ) n
+    ),
+    top_members AS (
+        SELECT COALESCE(json_agg(t ORDER BY t.average_score DESC, t.total_grades DESC), '[]'::json) as items
+        FROM (
+            SELECT 
+                u.id, 
+                u.full_name,
+                ROUND(AVG(g.score)::numeric, 1) as average_score,
+                COUNT(g.id)::integer as total_grades
+            FROM grades g
+            JOIN users u ON g.user_id = u.id
+            WHERE u.is_active = TRUE
+            GROUP BY u.id, u.full_name
+            ORDER BY average_score DESC, total_grades DESC
+            LIMIT 5
+        ) t
+    )
+    SELECT 
+        ms.member_count,
+        aps.pending_applications,
+        at.present_today,
+        at.expected_today,
+        ROUND(100.0 * at.present_today / NULLIF(at.expected_today, 0), 1) as attendance_rate,
+        rn.items as recent_news,
+        tm.items as top_members
+    FROM member_stats ms, application_stats aps, attendance_today at, recent_news rn, top_members tm
+"""
+
+PROFILE_RECENT_LIMIT = 20
+PROFILE_MAX_LIMIT = 100
+
+PROFILE_QUERY = """
+    SELECT 
+        u.id, 
+        u.email, 
+        u.full_name, 
+        u.role, 
+        u.created_at, 
+        u.is_active,
+        u.row_version,
+        gs.average_score,
+        gs.total_grades,
+        ats.present_days,
+        ats.recorded_days,
+        ROUND(100.0 * ats.present_days / NULLIF(ats.recorded_days, 0), 1) as attendance_rate,
+        COALESCE((
+            SELECT json_agg(g ORDER BY g.graded_at DESC)
+            FROM (
+                SELECT g.id, g.category, g.score, g.comment, g.graded_at, gb.full_name as graded_by_name
+                FROM grades g
+                LEFT JOIN users gb ON g.graded_by = gb.id
+                WHERE g.user_id = u.id
+                ORDER BY g.graded_at DESC
+                LIMIT %s
+            ) g
+        ), '[]'::json) as grades,
+        COALESCE((
+            SELECT json_agg(a ORDER BY a.date DESC)
+            FROM (
+                SELECT a.date, a.present, a.notes, a.archived
+                FROM (
+                    SELECT user_id, date, present, notes, FALSE as archived FROM attendance
+                    UNION ALL
+                    SELECT user_id, date, present, notes, TRUE as archived FROM attendance_archive
+                ) a
+                WHERE a.user_id = u.id
+                ORDER BY a.date DESC
+                LIMIT %s
+            ) a
+        ), '[]'::json) as attendance,
+        COALESCE((
+            SELECT json_agg(rh ORDER BY rh.changed_at DESC)
+            FROM (
+                SELECT rh.id, rh.old_role, rh.new_role, rh.changed_by_admin_id, 
+                       adm.full_name as admin_name, rh.changed_at, rh.reason, rh.archived
+                FROM (
+                    SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, FALSE as archived
+                    FROM role_history
+                    UNION ALL
+                    SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, TRUE as archived
+                    FROM role_history_archive
+                ) rh
+                LEFT JOIN users adm ON rh.changed_by_admin_id = adm.id
+                WHERE rh.user_id = u.id
+                ORDER BY rh.changed_at DESC
+                LIMIT %s
+            ) rh
+        ), '[]'::json) as role_history
+    FROM users u
+    LEFT JOIN LATERAL (
+        SELECT ROUND(AVG(score)::numeric, 1) as average_score, COUNT(id)::integer as total_grades
+        FROM grades
+        WHERE user_id = u.id
+    ) gs ON TRUE
+    LEFT JOIN LATERAL (
+        -- Старые отметки переносятся в архив обслуживанием, их итоги хранятся в attendance_term_summary
+        SELECT
+            (SELECT COUNT(id) FILTER (WHERE present) FROM attendance WHERE user_id = u.id)::integer
+                + COALESCE(SUM(s.present_days), 0)::integer as present_days,
+            (SELECT COUNT(id) FROM attendance WHERE user_id = u.id)::integer
+                + COALESCE(SUM(s.recorded_days), 0)::integer as recorded_days
+        FROM attendance_term_summary s
+        WHERE s.user_id = u.id
+    ) ats ON TRUE
+    WHERE u.id = %s
+"""
+
+ANALYTICS_CACHE_TTL = 300
+ANALYTICS_CACHE_SIZE = 64
+ANALYTICS_PERIODS = ('week', 'month', 'quarter', 'year')
+
+_analytics_cache: Dict[Any, Any] = {}
+
+# Кэш живёт в отдельном контейнере, а invalidate_analytics() очищает только тот, где менялись оценки.
+# Перед выдачей из кэша сверяемся с версией данных: row_version меняется при любой записи в grades/users,
+# удаления видны по deleted_rows. Запрос идёт по индексам row_version и намного дешевле самой аналитики
+ANALYTICS_VERSION_QUERY = """
+    SELECT GREATEST(
+        (SELECT MAX(row_version) FROM grades),
+        (SELECT MAX(row_version) FROM users),
+        (SELECT MAX(row_version) FROM deleted_rows)
+    ) as data_version
+"""
+
+ANALYTICS_QUERY = """
+    WITH scoped AS (
+        SELECT g.user_id, g.category, g.score, g.graded_at
+        FROM grades g
+        WHERE (%s::varchar IS NULL OR g.category = %s)
+    ),
+    category_stats AS (
+        SELECT COALESCE(json_agg(c ORDER BY c.category), '[]'::json) as items
+        FROM (
+            SELECT 
+                category,
+                COUNT(*)::integer as total_grades,
+                ROUND(AVG(score)::numeric, 1) as average_score,
+                MIN(score) as min_score,
+                MAX(score) as max_score,
+                ROUND(STDDEV_POP(score)::numeric, 1) as stddev,
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY score) as p25,
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY score) as median,
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY score) as p75,
+                percentile_cont(0.9) WITHIN GROUP (ORDER BY score) as p90
+            FROM scoped
+            GROUP BY category
+        ) c
+    ),
+    distribution AS (
+        SELECT COALESCE(json_agg(d ORDER BY d.category, d.bucket_start), '[]'::json) as items
+        FROM (
+            SELECT 
+                category,
+                LEAST(score / 10, 9) * 10 as bucket_start,
+                COUNT(*)::integer as total_grades
+            FROM scoped
+            GROUP BY 1, 2
+        ) d
+    ),
+    trends AS (
+        SELECT COALESCE(json_agg(t ORDER BY t.category, t.period), '[]'::json) as items
+        FROM (
+            SELECT 
+                category,
+                period,
+                total_grades,
+                average_score,
+                ROUND(AVG(average_score) OVER (
+                    PARTITION BY category ORDER BY period ROWS BETWEEN 2 PRECEDING AND CURRENT ROW
+                ), 1) as moving_average,
+                average_score - LAG(average_score) OVER (PARTITION BY category ORDER BY period) as change
+            FROM (
+                SELECT 
+                    category,
+                    date_trunc(%s, graded_at)::date as period,
+                    COUNT(*)::integer as total_grades,
+                    ROUND(AVG(score)::numeric, 1) as average_score
+                FROM scoped
+                GROUP BY 1, 2
+            ) p
+        ) t
+    ),
+    rankings AS (
+        SELECT COALESCE(json_agg(r ORDER BY r.rank, r.full_name), '[]'::json) as items
+        FROM (
+            SELECT 
+                u.id as user_id,
+                u.full_name,
+                ROUND(AVG(s.score)::numeric, 1) as average_score,
+                COUNT(*)::integer as total_grades,
+                RANK() OVER (ORDER BY AVG(s.score) DESC)::integer as rank,
+                ROUND((PERCENT_RANK() OVER (ORDER BY AVG(s.score)) * 100)::numeric, 1) as percentile
+            FROM scoped s
+            JOIN users u ON s.user_id = u.id
+            WHERE u.is_active = TRUE
+            GROUP BY u.id, u.full_name
+        ) r
+    )
+    SELECT 
+        c.items as categories,
+        d.items as distribution,
+        t.items as trends,
+        r.items as rankings
+    FROM category_stats c, distribution d, trends t, rankings r
+"""
+
+ROLE_UPDATE_QUERY = """
+    WITH target AS (
+        SELECT id, role, row_version
+        FROM users
+        WHERE id = %s
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE users u
+        SET role = %s
+        FROM target t
+        WHERE u.id = t.id AND (%s::bigint IS NULL OR u.row_version = %s::bigint)
+        RETURNING u.id, t.role as old_role, u.role as new_role, u.row_version
+    ),
+    history AS (
+        INSERT INTO role_history (user_id, old_role, new_role, changed_by_admin_id, reason)
+        SELECT id, old_role, new_role, %s, %s
+        FROM updated
+        WHERE old_role <> new_role
+        RETURNING id
+    )
+    SELECT t.row_version as current_version, up.old_role, up.row_version
+    FROM target t
+    LEFT JOIN updated up ON TRUE
+"""
+
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 2000
+CHANGE_FEED_TABLES = ('users', 'applications', 'grades', 'attendance', 'deleted')
+
+CHANGES_QUERY = """
+    SELECT 
+        COALESCE((
+            SELECT json_agg(u ORDER BY u.row_version)
+            FROM (
+                SELECT id, email, full_name, role, created_at, is_active, updated_at, row_version
+                FROM users
+                WHERE row_version > %s
+                ORDER BY row_version
+                LIMIT %s
+            ) u
+        ), '[]'::json) as users,
+        COALESCE((
+            SELECT json_agg(ap ORDER BY ap.row_version)
+            FROM (
+                SELECT id, full_name, email, phone, message, status, created_at, updated_at, row_version
+                FROM applications
+                WHERE row_version > %s
+                ORDER BY row_version
+                LIMIT %s
+            ) ap
+        ), '[]'::json) as applications,
+        COALESCE((
+            SELECT json_agg(g ORDER BY g.row_version)
+            FROM (
+                SELECT g.id, g.user_id, g.category, g.score, g.comment, g.graded_at,
+                       u1.full_name as user_name, u2.full_name as graded_by_name,
+                       g.updated_at, g.row_version
+                FROM grades g
+                LEFT JOIN users u1 ON g.user_id = u1.id
+                LEFT JOIN users u2 ON g.graded_by = u2.id
+                WHERE g.row_version > %s
+                ORDER BY g.row_version
+                LIMIT %s
+            ) g
+        ), '[]'::json) as grades,
+        COALESCE((
+            SELECT json_agg(a ORDER BY a.row_version)
+            FROM (
+                SELECT id, user_id, date, present, notes, updated_at, row_version
+                FROM attendance
+                WHERE row_version > %s
+                ORDER BY row_version
+                LIMIT %s
+            ) a
+        ), '[]'::json) as attendance,
+        COALESCE((
+            SELECT json_agg(d ORDER BY d.row_version)
+            FROM (
+                SELECT table_name, row_id, row_version, deleted_at
+                FROM deleted_rows
+                WHERE row_version > %s
+                ORDER BY row_version
+                LIMIT %s
+            ) d
+        ), '[]'::json) as deleted
+"""
+
+# Версии берутся из последовательности при записи, а видны читателю только после коммита,
+# поэтому курсор нельзя двигать за версии незавершённых транзакций. Каждый запрос журнала
+# запоминает пару (текущее значение последовательности, xmax снимка): когда самая старая
+# активная транзакция стала новее сохранённого xmax, все версии до сохранённой уже закоммичены
+CHANGE_WATERMARK_INTERVAL_SECONDS = 5
+
+# pruned_version: до этой версии записи об удалениях уже вычищены обслуживанием (backend/maintenance)
+CHANGE_FEED_STATE_QUERY = """
+    SELECT
+        COALESCE((
+            SELECT MAX(version)
+            FROM change_feed_watermarks
+            WHERE snapshot_xmax <= pg_snapshot_xmin(pg_current_snapshot())
+        ), 0) as settled_version,
+        COALESCE((SELECT pruned_version FROM change_feed_pruned), 0) as pruned_version
+"""
+
+CURRENT_VERSION_QUERY = "SELECT last_value as version FROM change_version_seq"
+
+RECORD_WATERMARK_QUERY = """
+    INSERT INTO change_feed_watermarks (version, snapshot_xmax)
+    SELECT %s, pg_snapshot_xmax(pg_current_snapshot())
+    WHERE NOT EXISTS (
+        SELECT 1 FROM change_feed_watermarks
+        WHERE recorded_at > NOW() - %s * INTERVAL '1 second'
+    )
+"""
+
+IDEMPOTENCY_TTL_HOURS = 24
+IDEMPOTENCY_CACHE_SIZE = 256
+IDEMPOTENCY_CLEANUP_INTERVAL = 3600
+IDEMPOTENCY_CLEANUP_BATCH = 500
+
+_idempotency_cache: Dict[Any, Any] = {}
+_idempotency_cleanup = {'last': 0.0}
+
+def get_idempotency(event: Dict[str, Any], scope: str) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers', {}) or {}
+    key = headers.get('idempotency-key', headers.get('Idempotency-Key'))
+    
+    if not key:
+        return None
+    
+    # Автор и права берутся из заголовков, поэтому тот же ключ от другого пользователя — другой запрос
+    fingerprint = json.dumps([
+        event.get('path') or '',
+        event.get('queryStringParameters') or {},
+        event.get('body') or '',
+        headers.get('x-user-id', headers.get('X-User-Id')) or '',
+        headers.get('x-user-role', headers.get('X-User-Role')) or ''
+    ], sort_keys=True)
+    
+    return {
+        'scope': f"{scope}:{event.get('httpMethod', 'GET')}",
+        'key': key[:255],
+        'request_hash': hashlib.sha256(fingerprint.encode()).hexdigest()
+    }
+
+def load_idempotent_response(cursor, idempotency: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not idempotency:
+        return None
+    
+    cache_key = (idempotency['scope'], idempotency['key'])
+    stored = _idempotency_cache.get(cache_key)
+    
+    if not stored or stored['expires'] <= time.time():
+        # Без курсора проверяется только кэш контейнера: повтор не должен платить за подключение к БД
+        if cursor is None:
+            return None
+        cursor.execute(
+            """
+            SELECT request_hash, status_code, response_body, 
+                   EXTRACT(EPOCH FROM expires_at - NOW()) as ttl
+            FROM idempotency_keys
+            WHERE scope = %s AND key = %s AND expires_at > NOW()
+            """,
+            cache_key
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        stored = remember_idempotent_response(cache_key, row['request_hash'], row['status_code'], row['response_body'], float(row['ttl']))
+    
+    if stored['request_hash'] != idempotency['request_hash']:
+        return {
+            'statusCode': 422,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+        }
+    
+    return {
+        'statusCode': stored['status_code'],
+        'headers': REPLAYED_HEADERS,
+        'body': stored['response_body']
+    }
+
+def remember_idempotent_response(cache_key, request_hash: str, status_code: int, response_body: str, ttl: float) -> Dict[str, Any]:
+    if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+        now = time.time()
+        for expired in [k for k, v in _idempotency_cache.items() if v['expires'] <= now]:
+            del _idempotency_cache[expired]
+        if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+            _idempotency_cache.clear()
+    
+    stored = {
+        'request_hash': request_hash,
+        'status_code': status_code,
+        'response_body': response_body,
+        'expires': time.time() + ttl
+    }
+    _idempotency_cache[cache_key] = stored
+    return stored
+
+def commit_idempotent(conn, cursor, idempotency: Optional[Dict[str, Any]], response: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''Коммитит запись вместе с ключом идемпотентности (истёкший ключ перезаписывается); при гонке дублей откатывает запись и возвращает сохранённый ответ или 409.'''
+    if not idempotency:
+        conn.commit()
+        return None
+    
+    cursor.execute(
+        """
+        INSERT INTO idempotency_keys (scope, key, request_hash, status_code, response_body, expires_at)
+        VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 hour')
+        ON CONFLICT (scope, key) DO UPDATE SET
+            request_hash = EXCLUDED.request_hash,
+            status_code = EXCLUDED.status_code,
+            response_body = EXCLUDED.response_body,
+            created_at = CURRENT_TIMESTAMP,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= NOW()
+        RETURNING key
+        """,
+        (idempotency['scope'], idempotency['key'], idempotency['request_hash'],
+         response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS)
+    )
+    
+    if cursor.fetchone() is None:
+        conn.rollback()
+        return load_idempotent_response(cursor, idempotency) or {
+            'statusCode': 409,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Request with this Idempotency-Key is in progress, retry later'})
+        }
+    
+    conn.commit()
+    remember_idempotent_response(
+        (idempotency['scope'], idempotency['key']), idempotency['request_hash'],
+        response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS * 3600
+    )
+    
+    if time.time() - _idempotency_cleanup['last'] > IDEMPOTENCY_CLEANUP_INTERVAL:
+        _idempotency_cleanup['last'] = time.time()
+        cursor.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE (scope, key) IN (
+                SELECT scope, key FROM idempotency_keys
+                WHERE expires_at < NOW()
+                LIMIT %s
+            )
+            """,
+            (IDEMPOTENCY_CLEANUP_BATCH,)
+        )
+        conn.commit()
+    
+    return None
 
 def get_db_connection():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+def invalidate_dashboard():
+    _dashboard_cache['body'] = None
+    _dashboard_cache['expires'] = 0.0
+
+def analytics_cache_key(query_params: Dict[str, Any]):
+    return (query_params.get('period', 'month'), query_params.get('category') or None)
+
+def invalidate_analytics():
+    _analytics_cache.clear()
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, PUT, DELETE, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Role, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return OPTIONS_RESPONSE
     
     headers = event.get('headers', {})
     user_role = headers.get('x-user-role', headers.get('X-User-Role', ''))
     
     if user_role != 'admin':
-        return {
-            'statusCode': 403,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Access denied'})
-        }
+        return ACCESS_DENIED_RESPONSE
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'GET' and query_params.get('dashboard') == 'true':
+        if _dashboard_cache['body'] is not None and _dashboard_cache['expires'] > time.monotonic():
+            return {
+                'statusCode': 200,
+                'headers': CACHE_HIT_HEADERS,
+                'body': _dashboard_cache['body']
+            }
+    
+    idempotency = get_idempotency(event, 'members') if method in ('PUT', 'POST', 'DELETE') else None
+    replay = load_idempotent_response(None, idempotency)
+    if replay:
+        return replay
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor = get_cursor(conn)
     
     try:
+        replay = load_idempotent_response(cursor, idempotency)
+        if replay:
+            return replay
+        
         if method == 'GET':
-            query_params = event.get('queryStringParameters', {}) or {}
+            if query_params.get('dashboard') == 'true':
+                cursor.execute(DASHBOARD_QUERY)
+                summary = cursor.fetchone()
+                
+                body = json.dumps(dict(summary), default=str)
+                _dashboard_cache['body'] = body
+                _dashboard_cache['expires'] = time.monotonic() + DASHBOARD_CACHE_TTL
+                
+                return {
+                    'statusCode': 200,
+                    'headers': CACHE_MISS_HEADERS,
+                    'body': body
+                }
+            
+            elif query_params.get('analytics') == 'true':
+                period, category = analytics_cache_key(query_params)
+                
+                if period not in ANALYTICS_PERIODS:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Invalid period'})
+                    }
+                
+                cursor.execute(ANALYTICS_VERSION_QUERY)
+                data_version = cursor.fetchone()['data_version']
+                
+                cached = _analytics_cache.get((period, category))
+                if cached and cached['version'] == data_version and cached['expires'] > time.monotonic():
+                    return {
+                        'statusCode': 200,
+                        'headers': CACHE_HIT_HEADERS,
+                        'body': cached['body']
+                    }
+                
+                cursor.execute(ANALYTICS_QUERY, (category, category, period))
+                analytics = dict(cursor.fetchone())
+                analytics['period'] = period
+                analytics['category'] = category
+                
+                body = json.dumps(analytics, default=str)
+                if len(_analytics_cache) >= ANALYTICS_CACHE_SIZE:
+                    _analytics_cache.clear()
+                _analytics_cache[(period, category)] = {
+                    'body': body,
+                    'version': data_version,
+                    'expires': time.monotonic() + ANALYTICS_CACHE_TTL
+                }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': CACHE_MISS_HEADERS,
+                    'body': body
+                }
+            
+            elif query_params.get('changes') == 'true':
+                try:
+                    since = max(0, int(query_params.get('since', 0)))
+                    limit = int(query_params.get('limit', CHANGES_DEFAULT_LIMIT))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Invalid since or limit'})
+                    }
+                limit = max(1, min(limit, CHANGES_MAX_LIMIT))
+                
+                cursor.execute(CHANGE_FEED_STATE_QUERY)
+                state = cursor.fetchone()
+                settled_version = state['settled_version']
+                
+                # since = 0 и есть полная синхронизация; иначе пропущенные удаления уже не восстановить
+                if 0 < since < state['pruned_version']:
+                    return {
+                        'statusCode': 410,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({
+                            'error': 'Change feed history expired, full resync required',
+                            'resync': True,
+                            'pruned_version': state['pruned_version']
+                        })
+                    }
+                
+                cursor.execute(CHANGES_QUERY, (since, limit) * len(CHANGE_FEED_TABLES))
+                changes = dict(cursor.fetchone())
+                
+                # Отдельными запросами: значение последовательности должно быть прочитано раньше снимка
+                cursor.execute(CURRENT_VERSION_QUERY)
+                current_version = cursor.fetchone()['version']
+                cursor.execute(RECORD_WATERMARK_QUERY, (current_version, CHANGE_WATERMARK_INTERVAL_SECONDS))
+                conn.commit()
+                
+                # Если какая-то таблица упёрлась в limit, следующий since не может быть дальше её последней версии,
+                # иначе клиент пропустит строки; повторно полученные строки клиент просто перезапишет по id.
+                # Дальше settled_version курсор тоже не двигается: строки за ним придут ещё раз (окно перекрытия)
+                truncated = [changes[t][-1]['row_version'] for t in CHANGE_FEED_TABLES if len(changes[t]) == limit]
+                versions = [rows[-1]['row_version'] for rows in (changes[t] for t in CHANGE_FEED_TABLES) if rows]
+                next_version = min(truncated) if truncated else max(versions + [since])
+                changes['version'] = max(since, min(next_version, settled_version))
+                # Если курсор не сдвинулся, повторный запрос вернёт ту же страницу: не зовём клиента сразу,
+                # а подсказываем, когда появится новая отметка журнала
+                changes['has_more'] = bool(truncated) and changes['version'] > since
+                if next_version > changes['version']:
+                    changes['retry_after'] = CHANGE_WATERMARK_INTERVAL_SECONDS
+                
+                return {
+                    'statusCode': 200,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps(changes, default=str)
+                }
             
-            if query_params.get('grades') == 'true':
+            elif query_params.get('profile') == 'true':
+                user_id = query_params.get('user_id')
+                
+                if not user_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'User ID required'})
+                    }
+                
+                try:
+                    limit = int(query_params.get('limit', PROFILE_RECENT_LIMIT))
+                except ValueError:
+                    limit = PROFILE_RECENT_LIMIT
+                limit = max(1, min(limit, PROFILE_MAX_LIMIT))
+                
+                cursor.execute(PROFILE_QUERY, (limit, limit, limit, user_id))
+                profile = cursor.fetchone()
+                
+                if not profile:
+                    return {
+                        'statusCode': 404,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'User not found'})
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps(dict(profile), default=str)
+                }
+            
+            elif query_params.get('grades') == 'true':
                 user_id = query_params.get('user_id')
                 
                 if user_id:
@@ -76,7 +760,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps([dict(record) for record in grades], default=str)
                 }
             
@@ -96,8 +780,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             rh.changed_by_admin_id,
                             a.full_name as admin_name,
                             rh.changed_at,
-                            rh.reason
-                        FROM role_history rh
+                            rh.reason,
+                            rh.archived
+                        FROM (
+                            SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, FALSE as archived
+                            FROM role_history
+                            UNION ALL
+                            SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, TRUE as archived
+                            FROM role_history_archive
+                        ) rh
                         LEFT JOIN users u ON rh.user_id = u.id
                         LEFT JOIN users a ON rh.changed_by_admin_id = a.id
                         WHERE rh.user_id = %s
@@ -118,8 +809,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             rh.changed_by_admin_id,
                             a.full_name as admin_name,
                             rh.changed_at,
-                            rh.reason
-                        FROM role_history rh
+                            rh.reason,
+                            rh.archived
+                        FROM (
+                            SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, FALSE as archived
+                            FROM role_history
+                            UNION ALL
+                            SELECT id, user_id, old_role, new_role, changed_by_admin_id, changed_at, reason, TRUE as archived
+                            FROM role_history_archive
+                        ) rh
                         LEFT JOIN users u ON rh.user_id = u.id
                         LEFT JOIN users a ON rh.changed_by_admin_id = a.id
                         ORDER BY rh.changed_at DESC
@@ -131,7 +829,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps([dict(record) for record in history], default=str)
                 }
             else:
@@ -139,7 +837,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 if show_deleted:
                     cursor.execute(
-                        "SELECT id, email, full_name, role, created_at, is_active FROM users WHERE is_active = FALSE ORDER BY created_at DESC"
+                        "SELECT id, email, full_name, role, created_at, is_active, row_version FROM users WHERE is_active = FALSE ORDER BY created_at DESC"
                     )
                     members = cursor.fetchall()
                 else:
@@ -152,12 +850,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             u.role, 
                             u.created_at, 
                             u.is_active,
+                            u.row_version,
                             ROUND(AVG(g.score)::numeric, 1) as average_score,
                             COUNT(g.id)::integer as total_grades
                         FROM users u
                         LEFT JOIN grades g ON u.id = g.user_id
                         WHERE u.is_active = TRUE
-                        GROUP BY u.id, u.email, u.full_name, u.role, u.created_at, u.is_active
+                        GROUP BY u.id, u.email, u.full_name, u.role, u.created_at, u.is_active, u.row_version
                         ORDER BY u.created_at DESC
                         """
                     )
@@ -165,7 +864,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps([dict(member) for member in members], default=str)
                 }
         
@@ -175,45 +874,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             new_role = body.get('role')
             admin_id = body.get('admin_id')
             reason = body.get('reason', '')
+            expected_version = body.get('row_version')
             
             if not user_id or not new_role:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'User ID and role required'})
                 }
             
             if new_role not in ['admin', 'member']:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'Invalid role'})
                 }
             
             cursor.execute(
-                "SELECT role FROM users WHERE id = %s",
-                (user_id,)
+                ROLE_UPDATE_QUERY,
+                (user_id, new_role, expected_version, expected_version, admin_id, reason)
             )
-            user = cursor.fetchone()
-            old_role = user['role'] if user else None
+            result = cursor.fetchone()
             
-            if old_role and old_role != new_role:
-                cursor.execute(
-                    "INSERT INTO role_history (user_id, old_role, new_role, changed_by_admin_id, reason) VALUES (%s, %s, %s, %s, %s)",
-                    (user_id, old_role, new_role, admin_id, reason)
-                )
+            if not result:
+                return {
+                    'statusCode': 404,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'User not found'})
+                }
             
-            cursor.execute(
-                "UPDATE users SET role = %s WHERE id = %s",
-                (new_role, user_id)
-            )
-            conn.commit()
+            if result['row_version'] is None:
+                conn.rollback()
+                return {
+                    'statusCode': 409,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'User was modified by another request', 'row_version': result['current_version']})
+                }
             
-            return {
+            response = {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True})
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'success': True, 'row_version': result['row_version']})
             }
+            replay = commit_idempotent(conn, cursor, idempotency, response)
+            if replay:
+                return replay
+            invalidate_dashboard()
+            
+            return response
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -225,7 +933,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if not user_id:
                     return {
                         'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'error': 'User ID required'})
                     }
                 
@@ -233,13 +941,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     "UPDATE users SET is_active = TRUE WHERE id = %s",
                     (user_id,)
                 )
-                conn.commit()
-                
-                return {
+                response = {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'success': True})
                 }
+                replay = commit_idempotent(conn, cursor, idempotency, response)
+                if replay:
+                    return replay
+                invalidate_dashboard()
+                invalidate_analytics()
+                
+                return response
             
             elif action == 'add_grade':
                 user_id = body.get('user_id')
@@ -251,7 +964,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if not all([user_id, category, score is not None]):
                     return {
                         'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'error': 'Missing required fields'})
                     }
                 
@@ -266,22 +979,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 
                 grade_id = cursor.fetchone()['id']
-                conn.commit()
-                
-                return {
+                response = {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'success': True, 'id': grade_id})
                 }
+                replay = commit_idempotent(conn, cursor, idempotency, response)
+                if replay:
+                    return replay
+                invalidate_dashboard()
+                invalidate_analytics()
+                
+                return response
             
             return {
                 'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
+                'headers': CORS_HEADERS,
                 'body': json.dumps({'error': 'Invalid action'})
             }
         
         elif method == 'DELETE':
-            query_params = event.get('queryStringParameters', {}) or {}
             body = json.loads(event.get('body', '{}')) if event.get('body') else {}
             
             if body.get('action') == 'delete_grade':
@@ -290,7 +1007,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if not grade_id:
                     return {
                         'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': JSON_HEADERS,
                         'body': json.dumps({'error': 'Grade ID required'})
                     }
                 
@@ -298,20 +1015,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     "DELETE FROM grades WHERE id = %s",
                     (grade_id,)
                 )
-                conn.commit()
-                
-                return {
+                response = {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'success': True})
                 }
+                replay = commit_idempotent(conn, cursor, idempotency, response)
+                if replay:
+                    return replay
+                invalidate_dashboard()
+                invalidate_analytics()
+                
+                return response
             
             user_id = query_params.get('id')
             
             if not user_id:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'User ID required'})
                 }
             
@@ -324,7 +1046,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if user and user['role'] == 'admin':
                 return {
                     'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'Cannot remove admin'})
                 }
             
@@ -332,19 +1054,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 "UPDATE users SET is_active = FALSE WHERE id = %s",
                 (user_id,)
             )
-            conn.commit()
-            
-            return {
+            response = {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'success': True})
             }
+            replay = commit_idempotent(conn, cursor, idempotency, response)
+            if replay:
+                return replay
+            invalidate_dashboard()
+            invalidate_analytics()
+            
+            return response
         
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return METHOD_NOT_ALLOWED_RESPONSE
     
     finally:
         cursor.close()
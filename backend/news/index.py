@@ -1,37 +1,363 @@
 '''
-Business: Управление новостями клуба (публикации с фото и видео)
+Business: Управление новостями клуба (публикации с фото и видео, загрузка изображений с превью)
 Args: event с httpMethod, body; context с request_id
 Returns: HTTP response со списком новостей или статусом создания
 '''
 
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import io
+import base64
+import hashlib
+import time
+from typing import Dict, Any, Optional, List
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+REPLAYED_HEADERS = {**JSON_HEADERS, 'Idempotent-Replayed': 'true'}
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Idempotency-Key',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+METHOD_NOT_ALLOWED_RESPONSE = {
+    'statusCode': 405,
+    'headers': CORS_HEADERS,
+    'body': json.dumps({'error': 'Method not allowed'})
+}
+
+MEDIA_MAX_BYTES = 10 * 1024 * 1024
+MEDIA_MAX_PIXELS = 40_000_000
+MEDIA_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+MEDIA_VARIANTS = (('thumb', 320), ('small', 640), ('medium', 1280), ('large', 1920))
+MEDIA_QUALITY = 80
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_media_store: Dict[str, Any] = {}
+
+class LocalMediaStore:
+    def __init__(self):
+        self.root = os.environ.get('MEDIA_ROOT', '/tmp/media')
+        self.base_url = os.environ['MEDIA_BASE_URL'].rstrip('/')
+    
+    def exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, key))
+    
+    def put(self, key: str, data: bytes, content_type: str):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+class S3MediaStore:
+    def __init__(self):
+        import boto3
+        from botocore.exceptions import ClientError
+        
+        self.client_error = ClientError
+        self.bucket = os.environ['S3_BUCKET']
+        self.client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+            aws_access_key_id=os.environ.get('S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('S3_SECRET_ACCESS_KEY')
+        )
+        default_base_url = f"{os.environ.get('S3_ENDPOINT_URL', 'https://s3.amazonaws.com').rstrip('/')}/{self.bucket}"
+        self.base_url = os.environ.get('MEDIA_BASE_URL', default_base_url).rstrip('/')
+    
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client_error:
+            return False
+    
+    def put(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl=MEDIA_CACHE_CONTROL
+        )
+    
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+def get_media_pool():
+    if 'pool' not in _media_store:
+        from concurrent.futures import ThreadPoolExecutor
+        _media_store['pool'] = ThreadPoolExecutor(max_workers=int(os.environ.get('MEDIA_WORKERS', 4)))
+    return _media_store['pool']
+
+def get_media_store():
+    '''Возвращает хранилище медиа или None, если не задано, откуда файлы будут раздаваться.'''
+    if 'store' not in _media_store:
+        if os.environ.get('MEDIA_STORE', 'local') == 's3':
+            if not os.environ.get('S3_BUCKET'):
+                return None
+            _media_store['store'] = S3MediaStore()
+        else:
+            # Функция сама файлы не раздаёт: MEDIA_ROOT должен обслуживаться внешним сервером по MEDIA_BASE_URL
+            if not os.environ.get('MEDIA_BASE_URL'):
+                return None
+            _media_store['store'] = LocalMediaStore()
+    return _media_store['store']
+
+def store_content(store, data: bytes, extension: str, content_type: str) -> str:
+    key = f"news/{hashlib.sha256(data).hexdigest()}.{extension}"
+    if not store.exists(key):
+        store.put(key, data, content_type)
+    return key
+
+def decode_image(encoded: Any) -> bytes:
+    if not isinstance(encoded, str):
+        raise ValueError('image_base64 must be a base64 string')
+    
+    if encoded.startswith('data:'):
+        encoded = encoded.split(',', 1)[-1]
+    
+    if len(encoded) > MEDIA_MAX_BYTES * 4 // 3 + 4:
+        raise ValueError('Image is too large')
+    
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise ValueError('Invalid base64 image')
+
+def render_variant(store, image, name: str, width: int) -> Dict[str, Any]:
+    from PIL import Image
+    
+    height = max(1, round(image.height * width / image.width))
+    resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+    
+    buffer = io.BytesIO()
+    resized.save(buffer, 'WEBP', quality=MEDIA_QUALITY, method=4)
+    data = buffer.getvalue()
+    
+    key = store_content(store, data, 'webp', 'image/webp')
+    return {'name': name, 'url': store.url(key), 'width': width, 'height': height, 'bytes': len(data)}
+
+def process_image(raw: bytes, store) -> Dict[str, Any]:
+    '''Сохраняет оригинал и WebP-варианты по адресу sha256 содержимого, ресайз идёт в пуле потоков.'''
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    
+    Image.MAX_IMAGE_PIXELS = MEDIA_MAX_PIXELS
+    
+    try:
+        image = Image.open(io.BytesIO(raw))
+        image_format = image.format
+        # Pillow лишь предупреждает до 2 * MAX_IMAGE_PIXELS, поэтому размер проверяется явно до декодирования
+        if image.width * image.height > MEDIA_MAX_PIXELS:
+            raise ValueError('Image dimensions are too large')
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise ValueError('Unsupported image')
+    
+    if image_format not in MEDIA_FORMATS:
+        raise ValueError('Unsupported image format')
+    
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    
+    original_key = store_content(store, raw, MEDIA_FORMATS[image_format], Image.MIME[image_format])
+    
+    widths: Dict[int, str] = {}
+    for name, width in MEDIA_VARIANTS:
+        widths.setdefault(min(width, image.width), name)
+    
+    futures = [get_media_pool().submit(render_variant, store, image, name, width) for width, name in widths.items()]
+    variants: List[Dict[str, Any]] = [future.result() for future in futures]
+    
+    return {
+        'original': {
+            'url': store.url(original_key),
+            'width': image.width,
+            'height': image.height,
+            'bytes': len(raw)
+        },
+        'variants': variants
+    }
+
+IDEMPOTENCY_TTL_HOURS = 24
+IDEMPOTENCY_CACHE_SIZE = 256
+IDEMPOTENCY_CLEANUP_INTERVAL = 3600
+IDEMPOTENCY_CLEANUP_BATCH = 500
+
+_idempotency_cache: Dict[Any, Any] = {}
+_idempotency_cleanup = {'last': 0.0}
+
+def get_idempotency(event: Dict[str, Any], scope: str) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers', {}) or {}
+    key = headers.get('idempotency-key', headers.get('Idempotency-Key'))
+    
+    if not key:
+        return None
+    
+    # Автор и права берутся из заголовков, поэтому тот же ключ от другого пользователя — другой запрос
+    fingerprint = json.dumps([
+        event.get('path') or '',
+        event.get('queryStringParameters') or {},
+        event.get('body') or '',
+        headers.get('x-user-id', headers.get('X-User-Id')) or '',
+        headers.get('x-user-role', headers.get('X-User-Role')) or ''
+    ], sort_keys=True)
+    
+    return {
+        'scope': f"{scope}:{event.get('httpMethod', 'GET')}",
+        'key': key[:255],
+        'request_hash': hashlib.sha256(fingerprint.encode()).hexdigest()
+    }
+
+def load_idempotent_response(cursor, idempotency: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not idempotency:
+        return None
+    
+    cache_key = (idempotency['scope'], idempotency['key'])
+    stored = _idempotency_cache.get(cache_key)
+    
+    if not stored or stored['expires'] <= time.time():
+        # Без курсора проверяется только кэш контейнера: повтор не должен платить за подключение к БД
+        if cursor is None:
+            return None
+        cursor.execute(
+            """
+            SELECT request_hash, status_code, response_body, 
+                   EXTRACT(EPOCH FROM expires_at - NOW()) as ttl
+            FROM idempotency_keys
+            WHERE scope = %s AND key = %s AND expires_at > NOW()
+            """,
+            cache_key
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        stored = remember_idempotent_response(cache_key, row['request_hash'], row['status_code'], row['response_body'], float(row['ttl']))
+    
+    if stored['request_hash'] != idempotency['request_hash']:
+        return {
+            'statusCode': 422,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+        }
+    
+    return {
+        'statusCode': stored['status_code'],
+        'headers': REPLAYED_HEADERS,
+        'body': stored['response_body']
+    }
+
+def remember_idempotent_response(cache_key, request_hash: str, status_code: int, response_body: str, ttl: float) -> Dict[str, Any]:
+    if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+        now = time.time()
+        for expired in [k for k, v in _idempotency_cache.items() if v['expires'] <= now]:
+            del _idempotency_cache[expired]
+        if len(_idempotency_cache) >= IDEMPOTENCY_CACHE_SIZE:
+            _idempotency_cache.clear()
+    
+    stored = {
+        'request_hash': request_hash,
+        'status_code': status_code,
+        'response_body': response_body,
+        'expires': time.time() + ttl
+    }
+    _idempotency_cache[cache_key] = stored
+    return stored
+
+def commit_idempotent(conn, cursor, idempotency: Optional[Dict[str, Any]], response: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''Коммитит запись вместе с ключом идемпотентности (истёкший ключ перезаписывается); при гонке дублей откатывает запись и возвращает сохранённый ответ или 409.'''
+    if not idempotency:
+        conn.commit()
+        return None
+    
+    cursor.execute(
+        """
+        INSERT INTO idempotency_keys (scope, key, request_hash, status_code, response_body, expires_at)
+        VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 hour')
+        ON CONFLICT (scope, key) DO UPDATE SET
+            request_hash = EXCLUDED.request_hash,
+            status_code = EXCLUDED.status_code,
+            response_body = EXCLUDED.response_body,
+            created_at = CURRENT_TIMESTAMP,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= NOW()
+        RETURNING key
+        """,
+        (idempotency['scope'], idempotency['key'], idempotency['request_hash'],
+         response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS)
+    )
+    
+    if cursor.fetchone() is None:
+        conn.rollback()
+        return load_idempotent_response(cursor, idempotency) or {
+            'statusCode': 409,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Request with this Idempotency-Key is in progress, retry later'})
+        }
+    
+    conn.commit()
+    remember_idempotent_response(
+        (idempotency['scope'], idempotency['key']), idempotency['request_hash'],
+        response['statusCode'], response['body'], IDEMPOTENCY_TTL_HOURS * 3600
+    )
+    
+    if time.time() - _idempotency_cleanup['last'] > IDEMPOTENCY_CLEANUP_INTERVAL:
+        _idempotency_cleanup['last'] = time.time()
+        cursor.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE (scope, key) IN (
+                SELECT scope, key FROM idempotency_keys
+                WHERE expires_at < NOW()
+                LIMIT %s
+            )
+            """,
+            (IDEMPOTENCY_CLEANUP_BATCH,)
+        )
+        conn.commit()
+    
+    return None
 
 def get_db_connection():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def get_cursor(conn):
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return OPTIONS_RESPONSE
+    
+    idempotency = get_idempotency(event, 'news') if method == 'POST' else None
+    replay = load_idempotent_response(None, idempotency)
+    if replay:
+        return replay
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor = get_cursor(conn)
     
     try:
+        replay = load_idempotent_response(cursor, idempotency)
+        if replay:
+            return replay
+        
         if method == 'GET':
             cursor.execute("""
                 SELECT n.*, u.full_name as author_name
@@ -45,7 +371,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps([dict(n) for n in news], default=str)
             }
         
@@ -53,25 +379,57 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body = json.loads(event.get('body', '{}'))
             headers = event.get('headers', {})
             author_id = headers.get('x-user-id', headers.get('X-User-Id'))
+            image_url = body.get('image_url')
+            thumbnail_url = None
+            image_variants = None
+            
+            if body.get('image_base64'):
+                try:
+                    raw = decode_image(body['image_base64'])
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                store = get_media_store()
+                if store is None:
+                    return {
+                        'statusCode': 500,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Media storage not configured'})
+                    }
+                
+                try:
+                    media = process_image(raw, store)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                image_url = media['original']['url']
+                thumbnail_url = media['variants'][0]['url']
+                image_variants = json.dumps(media)
             
             cursor.execute(
-                "INSERT INTO news (title, content, author_id, image_url, video_url) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (body.get('title'), body.get('content'), author_id, body.get('image_url'), body.get('video_url'))
+                "INSERT INTO news (title, content, author_id, image_url, video_url, thumbnail_url, image_variants) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+                (body.get('title'), body.get('content'), author_id, image_url, body.get('video_url'), thumbnail_url, image_variants)
             )
             result = cursor.fetchone()
-            conn.commit()
             
-            return {
+            response = {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'id': result['id']})
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'success': True, 'id': result['id'], 'image_url': image_url, 'thumbnail_url': thumbnail_url})
             }
+            replay = commit_idempotent(conn, cursor, idempotency, response)
+            
+            return replay or response
         
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return METHOD_NOT_ALLOWED_RESPONSE
     
     finally:
         cursor.close()
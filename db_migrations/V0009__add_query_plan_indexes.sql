@@ -0,0 +1,14 @@
+-- Индексы под реальные запросы обработчиков (выявлены scripts/check_query_plans.py)
+
+-- Оценки участника: WHERE user_id = ? ORDER BY graded_at DESC
+CREATE INDEX IF NOT EXISTS idx_grades_user_graded_at ON grades(user_id, graded_at DESC);
+-- Общий список оценок: ORDER BY graded_at DESC
+CREATE INDEX IF NOT EXISTS idx_grades_graded_at ON grades(graded_at DESC);
+-- Составной индекс покрывает поиск по user_id
+DROP INDEX IF EXISTS idx_grades_user_id;
+
+-- Лента новостей: LEFT JOIN users ON n.author_id = u.id
+CREATE INDEX IF NOT EXISTS idx_news_author_id ON news(author_id);
+
+-- Список заявок: ORDER BY created_at DESC
+CREATE INDEX IF NOT EXISTS idx_applications_created_at ON applications(created_at DESC);
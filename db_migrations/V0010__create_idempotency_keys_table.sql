@@ -0,0 +1,13 @@
+-- Ключи идемпотентности для повторных запросов на запись (заголовок Idempotency-Key)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(100) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER NOT NULL,
+    response_body TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
@@ -0,0 +1,77 @@
+-- Монотонные версии строк для инкрементальной синхронизации (members?changes=true&since=N)
+CREATE SEQUENCE IF NOT EXISTS change_version_seq;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('change_version_seq');
+
+ALTER TABLE applications ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE applications ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('change_version_seq');
+
+ALTER TABLE grades ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE grades ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('change_version_seq');
+
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('change_version_seq');
+
+CREATE INDEX IF NOT EXISTS idx_users_row_version ON users(row_version);
+CREATE INDEX IF NOT EXISTS idx_applications_row_version ON applications(row_version);
+CREATE INDEX IF NOT EXISTS idx_grades_row_version ON grades(row_version);
+CREATE INDEX IF NOT EXISTS idx_attendance_row_version ON attendance(row_version);
+
+-- Удалённые строки (оценки, посещаемость) отдаются клиенту как tombstone-записи
+CREATE TABLE IF NOT EXISTS deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(50) NOT NULL,
+    row_id INTEGER NOT NULL,
+    row_version BIGINT NOT NULL DEFAULT nextval('change_version_seq'),
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_deleted_rows_row_version ON deleted_rows(row_version);
+
+CREATE OR REPLACE FUNCTION touch_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.row_version := nextval('change_version_seq');
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_deleted_row() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deleted_rows (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_row_version ON users;
+CREATE TRIGGER trg_users_row_version BEFORE UPDATE ON users
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_applications_row_version ON applications;
+CREATE TRIGGER trg_applications_row_version BEFORE UPDATE ON applications
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_grades_row_version ON grades;
+CREATE TRIGGER trg_grades_row_version BEFORE UPDATE ON grades
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_attendance_row_version ON attendance;
+CREATE TRIGGER trg_attendance_row_version BEFORE UPDATE ON attendance
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_users_deleted ON users;
+CREATE TRIGGER trg_users_deleted AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
+
+DROP TRIGGER IF EXISTS trg_applications_deleted ON applications;
+CREATE TRIGGER trg_applications_deleted AFTER DELETE ON applications
+    FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
+
+DROP TRIGGER IF EXISTS trg_grades_deleted ON grades;
+CREATE TRIGGER trg_grades_deleted AFTER DELETE ON grades
+    FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
+
+DROP TRIGGER IF EXISTS trg_attendance_deleted ON attendance;
+CREATE TRIGGER trg_attendance_deleted AFTER DELETE ON attendance
+    FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
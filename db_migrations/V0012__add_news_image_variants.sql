@@ -0,0 +1,3 @@
+-- Превью и адаптивные варианты изображений новостей (WebP, адресация по sha256)
+ALTER TABLE news ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR(500);
+ALTER TABLE news ADD COLUMN IF NOT EXISTS image_variants JSONB;
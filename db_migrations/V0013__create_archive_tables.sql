@@ -0,0 +1,49 @@
+-- Архив и сводки для фоновой задачи обслуживания (backend/maintenance)
+
+-- Сводка посещаемости по участнику и четверти (term_start = начало квартала)
+CREATE TABLE IF NOT EXISTS attendance_term_summary (
+    user_id INTEGER NOT NULL,
+    term_start DATE NOT NULL,
+    recorded_days INTEGER NOT NULL DEFAULT 0,
+    present_days INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, term_start)
+);
+
+-- Архив посещаемости, секции по годам создаются задачей обслуживания
+CREATE TABLE IF NOT EXISTS attendance_archive (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    date DATE NOT NULL,
+    present BOOLEAN,
+    notes TEXT,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (date);
+
+CREATE INDEX IF NOT EXISTS idx_attendance_archive_user_date ON attendance_archive(user_id, date);
+
+-- Архив истории ролей, секции по годам
+CREATE TABLE IF NOT EXISTS role_history_archive (
+    id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    old_role VARCHAR(50) NOT NULL,
+    new_role VARCHAR(50) NOT NULL,
+    changed_by_admin_id INTEGER,
+    changed_at TIMESTAMP NOT NULL,
+    reason TEXT,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (changed_at);
+
+CREATE INDEX IF NOT EXISTS idx_role_history_archive_user_id ON role_history_archive(user_id);
+
+-- Перенос в архив не должен порождать tombstone-записи в журнале изменений
+CREATE OR REPLACE FUNCTION log_deleted_row() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('app.archiving', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
+    INSERT INTO deleted_rows (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,36 @@
+-- Безопасный курсор журнала изменений: версия строки выдаётся только после назначения xid транзакции,
+-- а пары (версия, xmax снимка) позволяют понять, до какой версии все транзакции уже завершены
+CREATE OR REPLACE FUNCTION touch_row_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_current_xact_id();
+    NEW.row_version := nextval('change_version_seq');
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_row_version_insert ON users;
+CREATE TRIGGER trg_users_row_version_insert BEFORE INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_applications_row_version_insert ON applications;
+CREATE TRIGGER trg_applications_row_version_insert BEFORE INSERT ON applications
+    FOR EACH ROW EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_grades_row_version_insert ON grades;
+CREATE TRIGGER trg_grades_row_version_insert BEFORE INSERT ON grades
+    FOR EACH ROW EXECUTE FUNCTION touch_row_version();
+
+DROP TRIGGER IF EXISTS trg_attendance_row_version_insert ON attendance;
+CREATE TRIGGER trg_attendance_row_version_insert BEFORE INSERT ON attendance
+    FOR EACH ROW EXECUTE FUNCTION touch_row_version();
+
+CREATE TABLE IF NOT EXISTS change_feed_watermarks (
+    id BIGSERIAL PRIMARY KEY,
+    version BIGINT NOT NULL,
+    snapshot_xmax XID8 NOT NULL,
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_feed_watermarks_snapshot_xmax ON change_feed_watermarks(snapshot_xmax);
+CREATE INDEX IF NOT EXISTS idx_change_feed_watermarks_recorded_at ON change_feed_watermarks(recorded_at);
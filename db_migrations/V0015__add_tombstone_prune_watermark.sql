@@ -0,0 +1,9 @@
+-- Максимальная версия удалённых записей журнала (deleted_rows), вычищенных задачей обслуживания.
+-- Клиент с since ниже этой версии мог пропустить удаления и должен выполнить полную синхронизацию
+CREATE TABLE IF NOT EXISTS change_feed_pruned (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO change_feed_pruned (id, pruned_version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,227 @@
+'''
+Business: Замер холодного старта и тёплых вызовов каждой функции из backend/*/index.py
+Args: --runs число запусков интерпретатора на функцию, --iterations число тёплых вызовов,
+      --update-baseline для перезаписи эталона
+Returns: код выхода 0, если время импорта, первого и тёплых запросов не выросло относительно эталона, иначе 1
+
+Каждая функция загружается в отдельном процессе `python -X importtime`, затем handler
+вызывается с обычным запросом (GET от администратора, для maintenance — POST с токеном).
+Запрос проходит через get_db_connection()/get_cursor() с настоящим импортом psycopg2,
+подменён только psycopg2.connect, поэтому замер можно запускать без БД. Отдельно
+показывается тёплый OPTIONS. В отчёт попадают самые тяжёлые импорты index.py и первого запроса.
+'''
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'cold_start_baseline.json'
+
+COLD_START_TOLERANCE = 0.3
+IMPORT_MARKER = '--- handler import ---'
+TOP_IMPORTS = 5
+
+# Первый «настоящий» запрос идёт через get_db_connection()/get_cursor(): сам psycopg2 импортируется
+# по-настоящему (это и есть отложенная стоимость холодного старта), подменяется только connect
+DEFAULT_REQUEST = {'httpMethod': 'GET', 'headers': {'X-User-Role': 'admin'}, 'queryStringParameters': {}}
+REQUEST_EVENTS: Dict[str, Dict[str, Any]] = {
+    'maintenance': {'httpMethod': 'POST', 'headers': {'X-Maintenance-Token': 'bench'}},
+}
+
+# Сравниваются с эталоном; второе число — абсолютный допуск, чтобы шум на микросекундах не ронял проверку
+TRACKED_METRICS = {'import_ms': 1.0, 'first_request_ms': 1.0, 'warm_request_us': 5.0}
+
+CHILD_CODE = '''
+import importlib.abc, importlib.util, json, os, sys, time
+path, iterations, marker, request = sys.argv[1], int(sys.argv[2]), sys.argv[3], json.loads(sys.argv[4])
+os.environ.setdefault('DATABASE_URL', 'postgresql://bench@localhost/bench')
+os.environ.setdefault('MAINTENANCE_TOKEN', 'bench')
+
+class Row(dict):
+    def __missing__(self, key):
+        return None
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        pass
+    def fetchone(self):
+        return Row()
+    def fetchall(self):
+        return []
+    def close(self):
+        pass
+
+class FakeConnection:
+    def cursor(self, cursor_factory=None):
+        return FakeCursor()
+    def commit(self):
+        pass
+    def rollback(self):
+        pass
+    def close(self):
+        pass
+
+class StubConnect(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, import_path, target=None):
+        if name != 'psycopg2':
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(name)
+        exec_module = spec.loader.exec_module
+        def patched(module):
+            exec_module(module)
+            module.connect = lambda *args, **kwargs: FakeConnection()
+        spec.loader.exec_module = patched
+        return spec
+
+sys.meta_path.insert(0, StubConnect())
+sys.stderr.write(marker + "\\\\n")
+sys.stderr.flush()
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("index", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_ms = (time.perf_counter() - started) * 1000
+
+def call(event):
+    try:
+        return module.handler(event, None).get('statusCode')
+    except Exception as e:
+        return type(e).__name__
+
+started = time.perf_counter()
+status = call(request)
+first_request_ms = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+for _ in range(iterations):
+    call(request)
+warm_request_us = (time.perf_counter() - started) * 1e6 / iterations
+options = {"httpMethod": "OPTIONS", "headers": {}}
+started = time.perf_counter()
+for _ in range(iterations):
+    call(options)
+options_call_us = (time.perf_counter() - started) * 1e6 / iterations
+print(json.dumps({
+    "import_ms": import_ms,
+    "first_request_ms": first_request_ms,
+    "warm_request_us": warm_request_us,
+    "options_call_us": options_call_us,
+    "status": status
+}))
+'''
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    '''Разбирает вывод -X importtime после маркера, оставляя импорты верхнего уровня из index.py.'''
+    imports = []
+    lines = stderr.split(IMPORT_MARKER, 1)[-1].splitlines()
+    for line in lines:
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() != 'index':
+            imports.append({'module': name.strip(), 'cumulative_ms': int(cumulative) / 1000})
+    return sorted(imports, key=lambda item: item['cumulative_ms'], reverse=True)[:TOP_IMPORTS]
+
+
+def measure(index_file: Path, iterations: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [
+            sys.executable, '-X', 'importtime', '-c', CHILD_CODE,
+            str(index_file), str(iterations), IMPORT_MARKER,
+            json.dumps(REQUEST_EVENTS.get(index_file.parent.name, DEFAULT_REQUEST))
+        ],
+        capture_output=True,
+        text=True,
+        cwd=index_file.parent
+    )
+    process_ms = (time.perf_counter() - started) * 1000
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'child process failed')
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = process_ms
+    timings['imports'] = parse_importtime(result.stderr)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark cold start and warm invocation of backend handlers')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=COLD_START_TOLERANCE)
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args(argv)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    report: Dict[str, Dict[str, Any]] = {}
+    failures = []
+
+    for index_file in sorted(BACKEND_DIR.glob('*/index.py')):
+        function = index_file.parent.name
+        try:
+            runs = [measure(index_file, args.iterations) for _ in range(args.runs)]
+        except RuntimeError as e:
+            failures.append(f"{function}: {e}")
+            continue
+
+        summary = {
+            'import_ms': round(statistics.median(run['import_ms'] for run in runs), 2),
+            'first_request_ms': round(statistics.median(run['first_request_ms'] for run in runs), 3),
+            'warm_request_us': round(statistics.median(run['warm_request_us'] for run in runs), 2),
+            'options_call_us': round(statistics.median(run['options_call_us'] for run in runs), 2),
+            'process_ms': round(statistics.median(run['process_ms'] for run in runs), 1),
+            'status': runs[-1]['status'],
+            'imports': runs[-1]['imports'],
+        }
+        report[function] = summary
+
+        heaviest = ', '.join(f"{item['module']} {item['cumulative_ms']:.1f}ms" for item in summary['imports'])
+        print(
+            f"{function:14} import={summary['import_ms']:>7.2f}ms first={summary['first_request_ms']:>7.3f}ms "
+            f"warm={summary['warm_request_us']:>7.2f}us options={summary['options_call_us']:>5.2f}us "
+            f"process={summary['process_ms']:>7.1f}ms status={summary['status']}  {heaviest}"
+        )
+
+        for metric, slack in TRACKED_METRICS.items():
+            previous = baseline.get(function, {}).get(metric)
+            if previous is None or args.update_baseline:
+                continue
+            if summary[metric] > max(previous * (1 + args.tolerance), previous + slack):
+                failures.append(f"{function}: {metric} grew {previous:.2f} -> {summary[metric]:.2f}")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.update_baseline:
+        stored = {
+            function: {key: value for key, value in summary.items() if key not in ('imports', 'status')}
+            for function, summary in report.items()
+        }
+        args.baseline.write_text(json.dumps(stored, indent=2, sort_keys=True) + '\n')
+        print(f"Baseline written to {args.baseline}")
+
+    if failures:
+        print('\nProblems:')
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
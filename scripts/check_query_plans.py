@@ -0,0 +1,377 @@
+'''
+Business: Проверка планов выполнения всех SQL-запросов из backend/*/index.py
+Args: --database-url (или DATABASE_URL) локальной БД, --seed для наполнения тестовыми данными,
+      --update-baseline для перезаписи эталонной стоимости планов
+Returns: код выхода 0, если планы в норме; 1 при новом seq scan по большой таблице,
+         отсутствующих индексах или росте стоимости выше эталона
+
+Seq scan не считается ошибкой, если он уже записан в эталоне для этого запроса или
+разрешён в самом SQL комментарием `-- plan-check: allow-seq-scan [таблица, ...]`
+(без списка таблиц разрешён seq scan по любой таблице).
+
+Запросы выполняются через EXPLAIN (ANALYZE, BUFFERS) внутри транзакции,
+которая всегда откатывается, поэтому INSERT/UPDATE/DELETE не меняют данные.
+Запускать только на локальной копии базы с применёнными db_migrations.
+'''
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'query_plan_baseline.json'
+
+EXPLAINABLE = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.I)
+ALLOW_SEQ_SCAN = re.compile(r'--\s*plan-check:\s*allow-seq-scan\b([^\n]*)', re.I)
+
+LARGE_TABLE_ROWS = 1000
+COST_TOLERANCE = 0.2
+# Абсолютный допуск: стоимость запросов к почти пустым таблицам скачет от статистики, а не от плана
+COST_SLACK = 10.0
+
+EXPECTED_INDEXES: List[Tuple[str, Tuple[str, ...]]] = [
+    ('grades', ('user_id', 'graded_at')),
+    ('news', ('author_id',)),
+    ('applications', ('created_at',)),
+    ('attendance', ('user_id', 'date')),
+    ('role_history', ('user_id',)),
+]
+
+SAMPLE_VALUES: Dict[str, str] = {
+    'id': '1',
+    'user_id': '1',
+    'author_id': '1',
+    'graded_by': '1',
+    'changed_by_admin_id': '1',
+    'email': 'plan-check@example.com',
+    'password_hash': '240be518fabd2724ddb6f04eeb1da5967448d7e831c08c8fa822809f74c720a9',
+    'role': 'member',
+    'old_role': 'member',
+    'new_role': 'admin',
+    'status': 'pending',
+    'score': '75',
+    'present': 'true',
+    'is_active': 'true',
+    'telegram_id': '100000001',
+    'category': 'Практика',
+    'date_trunc': 'month',
+}
+
+SAMPLE_NAMED_VALUES: Dict[str, Any] = {
+    'batch_size': 1000,
+    'retention_days': 365,
+    'inactive_days': 180,
+    'date': date.today().isoformat(),
+    'present': True,
+    'notes': '',
+}
+
+# Повторный --seed не дублирует строки: всё тестовое помечено и вставляется только при отсутствии
+SEED_SQL = '''
+INSERT INTO users (email, password_hash, full_name, role, is_active)
+SELECT 'seed_' || i || '@plan.check', '', 'Участник ' || i, 'member', i %% 20 <> 0
+FROM generate_series(1, %(users)s) AS i
+ON CONFLICT (email) DO NOTHING;
+
+INSERT INTO grades (user_id, category, score, comment, graded_by, graded_at)
+SELECT u.id,
+       (ARRAY['Теория', 'Практика', 'Проект', 'Активность'])[1 + (g %% 4)],
+       (g * 37) %% 101, 'plan-check seed', 1, NOW() - (g %% 365) * INTERVAL '1 day'
+FROM (SELECT id FROM users WHERE email LIKE 'seed_%%@plan.check') u
+CROSS JOIN generate_series(1, %(grades_per_user)s) AS g
+WHERE NOT EXISTS (
+    SELECT 1 FROM grades gr WHERE gr.user_id = u.id AND gr.comment = 'plan-check seed'
+);
+
+INSERT INTO attendance (user_id, date, present, notes)
+SELECT u.id, CURRENT_DATE - d, (u.id + d) %% 5 <> 0, ''
+FROM (SELECT id FROM users WHERE email LIKE 'seed_%%@plan.check') u
+CROSS JOIN generate_series(0, %(attendance_days)s - 1) AS d
+ON CONFLICT (user_id, date) DO NOTHING;
+
+INSERT INTO applications (full_name, email, phone, message, status, created_at)
+SELECT 'Заявитель ' || i, 'apply_' || i || '@plan.check', '', '',
+       (ARRAY['pending', 'approved', 'rejected'])[1 + (i %% 3)],
+       NOW() - (i %% 500) * INTERVAL '1 hour'
+FROM generate_series(1, %(applications)s) AS i
+WHERE NOT EXISTS (
+    SELECT 1 FROM applications a WHERE a.email = 'apply_' || i || '@plan.check'
+);
+
+INSERT INTO news (title, content, author_id, created_at)
+SELECT 'Новость ' || i, 'plan-check seed', 1, NOW() - i * INTERVAL '1 hour'
+FROM generate_series(1, %(news)s) AS i
+WHERE NOT EXISTS (
+    SELECT 1 FROM news n WHERE n.title = 'Новость ' || i AND n.content = 'plan-check seed'
+);
+
+INSERT INTO role_history (user_id, old_role, new_role, changed_by_admin_id, reason)
+SELECT u.id, 'member', 'admin', 1, 'plan-check seed'
+FROM (SELECT id FROM users WHERE email LIKE 'seed_%%@plan.check' ORDER BY id LIMIT %(role_changes)s) u
+WHERE NOT EXISTS (
+    SELECT 1 FROM role_history rh WHERE rh.user_id = u.id AND rh.reason = 'plan-check seed'
+);
+
+ANALYZE;
+'''
+
+
+def extract_queries(backend_dir: Path) -> List[Dict[str, Any]]:
+    queries = []
+    for index_file in sorted(backend_dir.glob('*/index.py')):
+        function = index_file.parent.name
+        tree = ast.parse(index_file.read_text(encoding='utf-8'))
+        constants = {
+            target.id: (node.lineno, node.value.value)
+            for node in tree.body if isinstance(node, ast.Assign)
+            and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+            for target in node.targets if isinstance(target, ast.Name)
+        }
+        # Запросы из констант *_QUERY учитываются, даже если передаются в execute через переменную
+        statements = [(line, sql) for name, (line, sql) in constants.items() if name.endswith('_QUERY')]
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+                continue
+            if node.func.attr != 'execute' or not node.args:
+                continue
+            sql_node = node.args[0]
+            if isinstance(sql_node, ast.Constant) and isinstance(sql_node.value, str):
+                statements.append((node.lineno, sql_node.value))
+
+        seen = set()
+        for line, sql in sorted(statements):
+            if not EXPLAINABLE.match(sql):
+                continue
+            normalized = ' '.join(sql.split())
+            key = f"{function}:{hashlib.sha1(normalized.encode()).hexdigest()[:10]}"
+            if key in seen:
+                continue
+            seen.add(key)
+            queries.append({
+                'key': key,
+                'function': function,
+                'line': line,
+                'sql': sql,
+                'summary': normalized[:90],
+            })
+    return queries
+
+
+def sample_params(sql: str):
+    '''Подбирает значения для %s по имени колонки рядом с плейсхолдером; именованные %(name)s получают числа.'''
+    named = re.findall(r'%\((\w+)\)s', sql)
+    if named:
+        return {name: SAMPLE_NAMED_VALUES.get(name, 1) for name in named}
+
+    names: List[Optional[str]] = []
+    insert = re.search(r'INSERT\s+INTO\s+\w+(?:\.\w+)?\s*\(([^)]*)\)\s*VALUES\s*\(([^)]*)\)', sql, re.I | re.S)
+    insert_columns = [c.strip() for c in insert.group(1).split(',')] if insert else []
+    insert_values = [v.strip() for v in insert.group(2).split(',')] if insert else []
+
+    for match in re.finditer(r'%s', sql):
+        before = sql[:match.start()]
+        if insert and insert.start(2) <= match.start() < insert.end(2):
+            position = before[insert.start(2):].count(',')
+            column = insert_columns[position] if position < len(insert_columns) else None
+            names.append(column)
+            continue
+        if re.search(r'date_trunc\(\s*$', before, re.I):
+            names.append('date_trunc')
+            continue
+        column = re.search(r'(\w+)\s*(?:=|<>|>=|<=|>|<)\s*$', before)
+        names.append(column.group(1) if column else None)
+
+    values = []
+    for name in names:
+        if name and name.endswith('date'):
+            values.append(date.today().isoformat())
+        else:
+            values.append(SAMPLE_VALUES.get(name or '', '1'))
+    return tuple(values)
+
+
+def walk_plan(node: Dict[str, Any]):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+
+def table_sizes(cursor) -> Dict[str, float]:
+    cursor.execute(
+        "SELECT c.relname, c.reltuples FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relkind IN ('r', 'p') AND n.nspname = ANY (current_schemas(false))"
+    )
+    return {name: rows for name, rows in cursor.fetchall()}
+
+
+def missing_indexes(cursor) -> List[str]:
+    cursor.execute(
+        """
+        SELECT t.relname, array_agg(a.attname ORDER BY k.ord)
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        WHERE n.nspname = ANY (current_schemas(false))
+        GROUP BY t.relname, i.indexrelid
+        """
+    )
+    existing: Dict[str, List[Tuple[str, ...]]] = {}
+    for table, columns in cursor.fetchall():
+        existing.setdefault(table, []).append(tuple(columns))
+
+    problems = []
+    for table, columns in EXPECTED_INDEXES:
+        if not any(index[:len(columns)] == columns for index in existing.get(table, [])):
+            problems.append(f"missing index on {table}({', '.join(columns)})")
+    return problems
+
+
+def explain(conn, query: Dict[str, Any]) -> Dict[str, Any]:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query['sql'],
+            sample_params(query['sql'])
+        )
+        return cursor.fetchone()[0][0]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def allowed_seq_scans(sql: str) -> List[str]:
+    '''Таблицы из комментариев `-- plan-check: allow-seq-scan`; '*' означает любую таблицу.'''
+    allowed = []
+    for match in ALLOW_SEQ_SCAN.finditer(sql):
+        tables = re.findall(r'\w+', match.group(1))
+        allowed.extend(tables or ['*'])
+    return allowed
+
+
+def seq_scans(plan: Dict[str, Any], sizes: Dict[str, float]) -> List[str]:
+    return sorted({
+        node.get('Relation Name', '')
+        for node in walk_plan(plan['Plan'])
+        if node.get('Node Type') == 'Seq Scan' and sizes.get(node.get('Relation Name', ''), 0) >= LARGE_TABLE_ROWS
+    })
+
+
+def check_plan(plan: Dict[str, Any], sizes: Dict[str, float], allowed: List[str]) -> List[str]:
+    problems = []
+    for node in walk_plan(plan['Plan']):
+        if node.get('Node Type') != 'Seq Scan':
+            continue
+        relation = node.get('Relation Name', '')
+        rows = sizes.get(relation, 0)
+        if rows < LARGE_TABLE_ROWS or '*' in allowed or relation in allowed:
+            continue
+        detail = f" filter {node['Filter']}" if node.get('Filter') else ''
+        problems.append(f"new seq scan on {relation} (~{int(rows)} rows){detail}")
+    return problems
+
+
+def baseline_entry(entry: Any) -> Dict[str, Any]:
+    '''Старый формат эталона хранил только стоимость плана.'''
+    if isinstance(entry, dict):
+        return entry
+    return {'cost': entry, 'seq_scans': []}
+
+
+def is_local(database_url: str) -> bool:
+    host = urlparse(database_url).hostname
+    return host in (None, '', 'localhost', '127.0.0.1', '::1')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='EXPLAIN ANALYZE every SQL statement in backend handlers')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--seed', action='store_true', help='fill the database with synthetic rows first')
+    parser.add_argument('--seed-users', type=int, default=2000)
+    parser.add_argument('--tolerance', type=float, default=COST_TOLERANCE)
+    parser.add_argument('--allow-remote', action='store_true')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('DATABASE_URL is not set')
+    if not is_local(args.database_url) and not args.allow_remote:
+        parser.error('refusing to run EXPLAIN ANALYZE against a non-local database (use --allow-remote)')
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        if args.seed:
+            cursor = conn.cursor()
+            cursor.execute(SEED_SQL, {
+                'users': args.seed_users,
+                'grades_per_user': 20,
+                'attendance_days': 60,
+                'applications': args.seed_users,
+                'news': args.seed_users // 4,
+                'role_changes': args.seed_users // 10,
+            })
+            conn.commit()
+            cursor.close()
+
+        cursor = conn.cursor()
+        sizes = table_sizes(cursor)
+        failures = missing_indexes(cursor)
+        cursor.close()
+        conn.rollback()
+
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        recorded: Dict[str, Dict[str, Any]] = {}
+
+        for query in extract_queries(BACKEND_DIR):
+            location = f"{query['function']}/index.py:{query['line']}"
+            try:
+                plan = explain(conn, query)
+            except psycopg2.Error as e:
+                failures.append(f"{location} EXPLAIN failed: {str(e).strip()}")
+                continue
+
+            cost = plan['Plan']['Total Cost']
+            recorded[query['key']] = {'cost': cost, 'seq_scans': seq_scans(plan, sizes)}
+            print(f"{location:32} cost={cost:>10.2f} time={plan.get('Execution Time', 0):>8.2f}ms  {query['summary']}")
+
+            if args.update_baseline:
+                continue
+
+            previous = baseline_entry(baseline[query['key']]) if query['key'] in baseline else None
+            allowed = allowed_seq_scans(query['sql']) + (previous['seq_scans'] if previous else [])
+            for problem in check_plan(plan, sizes, allowed):
+                failures.append(f"{location} {problem}")
+
+            if previous is not None and cost > max(previous['cost'] * (1 + args.tolerance), previous['cost'] + COST_SLACK):
+                failures.append(f"{location} plan cost grew {previous['cost']:.2f} -> {cost:.2f}")
+    finally:
+        conn.close()
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(recorded, indent=2, sort_keys=True) + '\n')
+        print(f"Baseline written to {args.baseline}")
+
+    if failures:
+        print('\nProblems:')
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())